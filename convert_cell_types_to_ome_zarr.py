@@ -1,17 +1,22 @@
 import pathlib
 import argparse
+import functools
 import time
-import numpy as np
 import multiprocessing
-from neuroglancer_interface.utils.multiprocessing_utils import (
-    _winnow_process_list)
+
+from neuroglancer_interface.utils.utils import (
+    find_files_by_suffix)
 
 from neuroglancer_interface.utils.celltypes_utils import (
     get_class_lookup)
 
+from neuroglancer_interface.utils.multiprocessing_utils import (
+    get_n_threads_per_worker)
+
 from neuroglancer_interface.utils.data_utils import (
     write_nii_file_list_to_ome_zarr,
-    write_summed_nii_files_to_group)
+    write_summed_nii_files_to_group,
+    open_group)
 
 def write_summed_object(
         cluster_to_path,
@@ -22,86 +27,91 @@ def write_summed_object(
         prefix=None):
 
     t0 = time.time()
-    full_group_list = _get_valid_group_list(
+    group_to_paths = _get_group_to_paths(
                         obj_to_clusters=obj_to_clusters,
                         cluster_to_path=cluster_to_path)
 
-    if len(full_group_list) == 0:
+    if len(group_to_paths) == 0:
         return root_group
 
+    parent_group_path = pathlib.Path(root_group.store.path)
     if prefix is not None:
-        parent_group = root_group.create_group(prefix)
-    else:
-        parent_group = root_group
+        root_group.create_group(prefix)
+        parent_group_path = parent_group_path / prefix
 
     n_workers = max(1, n_processors-1)
-
-    n_per_processor = max(1,
-                          np.floor(len(full_group_list)/n_workers).astype(int))
-    process_list = []
-    for i0 in range(0, len(full_group_list), n_per_processor):
-        i1 = min(i0+n_per_processor, len(full_group_list))
-        group_list = full_group_list[i0:i1]
-        p = multiprocessing.Process(
-                target=_write_summed_object_worker,
-                kwargs={'parent_group': parent_group,
-                        'group_list': group_list,
-                        'obj_to_clusters': obj_to_clusters,
-                        'cluster_to_path': cluster_to_path,
-                        'downscale': downscale})
-        p.start()
-        process_list.append(p)
-        while len(process_list) >= n_workers:
-            process_list = _winnow_process_list(process_list)
-
-    for p in process_list:
-        p.join()
+    n_workers = min(n_workers, len(group_to_paths))
+
+    # one task per group so that groups with many clusters
+    # do not hold up the other workers
+    worker = functools.partial(
+                _write_one_group,
+                parent_group_path=str(parent_group_path),
+                downscale=downscale,
+                n_io_threads=get_n_threads_per_worker(n_workers))
+
+    with multiprocessing.Pool(n_workers, maxtasksperchild=8) as pool:
+        for _ in pool.imap_unordered(worker,
+                                     group_to_paths.items(),
+                                     chunksize=1):
+            pass
 
     duration = time.time()-t0
     print(f"{prefix} took {duration:.2e} seconds")
     return root_group
 
 
-def _write_summed_object_worker(
-        parent_group,
-        group_list,
-        obj_to_clusters,
-        cluster_to_path,
-        downscale):
+def _write_one_group(
+        key_and_paths,
+        parent_group_path,
+        downscale,
+        n_io_threads=4):
+    """
+    Sum the files associated with one group and write them
+    to a new group under the group at parent_group_path
 
-    for key in group_list:
-        cluster_list = obj_to_clusters[key]
-        file_path_list = [cluster_to_path[c] for c in cluster_list
-                          if c in cluster_to_path]
+    key_and_paths is a (group name, list of file paths) tuple
 
-        if len(file_path_list) > 0:
-            group_name = key
-            this_group = parent_group.create_group(group_name)
-            write_summed_nii_files_to_group(
-                file_path_list=file_path_list,
-                group=this_group,
-                downscale=downscale)
+    n_io_threads is the number of threads compressing and
+    writing chunks
+
+    (the parent group is re-opened from its path because zarr
+    groups are not reliably picklable)
+    """
+    (key,
+     file_path_list) = key_and_paths
+
+    parent_group = open_group(parent_group_path)
+    this_group = parent_group.create_group(key)
+    # chunked for the census, which reads these back in
+    write_summed_nii_files_to_group(
+        file_path_list=file_path_list,
+        group=this_group,
+        downscale=downscale,
+        default_chunk=64,
+        n_io_threads=n_io_threads)
 
-            print(f"wrote group {key}")
+    print(f"wrote group {key}")
 
 
-def _get_valid_group_list(
+def _get_group_to_paths(
         obj_to_clusters,
         cluster_to_path):
     """
-    Returns list of objects that have non-zero number
-    of valid cluster files
+    Returns a dict mapping each object that has a non-zero
+    number of valid cluster files to the list of those files
+    (sorted by object name)
     """
     raw_group_list = list(obj_to_clusters.keys())
     raw_group_list.sort()
-    full_group_list = []
+    group_to_paths = dict()
     for group in raw_group_list:
-        cluster_list = obj_to_clusters[group]
-        file_path_list = [cluster_to_path[c] for c in cluster_list
+        file_path_list = [cluster_to_path[c]
+                          for c in obj_to_clusters[group]
                           if c in cluster_to_path]
         if len(file_path_list) > 0:
-            full_group_list.append(group)
-    return full_group_list
+            group_to_paths[group] = file_path_list
+    return group_to_paths
 
 
 def main():
@@ -141,15 +151,17 @@ def main():
      valid_clusters,
      desanitizer) = get_class_lookup(args.annotation_path)
 
-    fpath_list = [n for n in input_dir.rglob('*nii.gz')]
+    fpath_list = find_files_by_suffix(input_dir, suffix='nii.gz')
     fpath_list.sort()
+    suffix_len = len(suffix)
     cluster_name_list = []
     cluster_to_path = dict()
     for fpath in fpath_list:
+        # file names are {something}_{cluster_name}{suffix}
         fname = fpath.name
-        params = fname.split('_')
-        cluster_name = fname.replace(f"{params[0]}_", "")
-        cluster_name = cluster_name.replace(suffix, "")
+        cluster_name = fname[fname.find('_')+1:]
+        if cluster_name.endswith(suffix):
+            cluster_name = cluster_name[:-suffix_len]
         assert cluster_name in valid_clusters
         cluster_name_list.append(cluster_name)
         cluster_to_path[cluster_name] = fpath
@@ -161,7 +173,8 @@ def main():
             downscale=args.downscale,
             n_processors=args.n_processors,
             clobber=args.clobber,
-            prefix="clusters")
+            prefix="clusters",
+            default_chunk=64)
 
     root_group = write_summed_object(
             cluster_to_path=cluster_to_path,
@@ -1,12 +1,15 @@
 from cloudvolume import CloudVolume
+import os
 import warnings
 import argparse
+import functools
 import shutil
 import PIL
 import pathlib
 import numpy as np
 import json
 import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 import skimage.transform
 
 try:
@@ -15,6 +18,18 @@ try:
 except ModuleNotFoundError:
     has_aff = False
 
+try:
+    import orjson
+    has_orjson = True
+except ModuleNotFoundError:
+    has_orjson = False
+
+try:
+    import cv2
+    has_cv2 = True
+except ModuleNotFoundError:
+    has_cv2 = False
+
 
 def make_info_file(
         resolution_xyz,
@@ -83,54 +98,96 @@ def make_info_file(
         scale_list.append(this_scale)
 
     info["scales"] = scale_list
-    with open(f"{layer_dir}/info", "w") as out_file:
-        out_file.write(json.dumps(info, indent=2))
+    if has_orjson:
+        # z_to_LIMS_metadata is keyed on int
+        with open(f"{layer_dir}/info", "wb") as out_file:
+            out_file.write(
+                orjson.dumps(
+                    info,
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(f"{layer_dir}/info", "w") as out_file:
+            out_file.write(json.dumps(info, indent=2))
 
     return info
 
+def _pad_into_buffer(
+        data,
+        out):
+    """
+    Copy data into the upper left corner of out, zeroing
+    only the parts of out that data does not cover
+    (rather than zeroing the whole buffer).
+
+    Returns out
+    """
+    h = data.shape[0]
+    w = data.shape[1]
+    out[h:, :, :] = 0
+    out[:h, w:, :] = 0
+    np.copyto(out[:h, :w, :], data)
+    return out
+
+
 def read_and_pad_image(
         image_path,
-        np_target_shape):
+        np_target_shape,
+        out=None):
     """
     np_target_shape is the shape of the np.array
     we want to return; will be the transpose of the
     img.size
+
+    out is an optional pre-allocated uint8 buffer of
+    shape np_target_shape to be re-used
     """
 
-    result = np.zeros(np_target_shape, dtype=np.uint8)
+    if out is None:
+        out = np.zeros(np_target_shape, dtype=np.uint8)
     with PIL.Image.open(image_path, 'r') as img:
-        result[:img.size[1],
-               :img.size[0],
-               :] = np.array(img)
+        _pad_into_buffer(data=np.array(img), out=out)
 
-    return result
+    return out
+
+
+@functools.lru_cache(maxsize=4)
+def _get_aff_pyramid(image_path):
+    """
+    Open (and cache) the AffPyramid at image_path, so that
+    several sections cut from the same image only pay the
+    cost of opening it once
+    """
+    return affpyramid.AffPyramid(image_path)
 
 
 def read_and_pad_image_config(
         image_config,
         image_path,
-        np_target_shape):
+        np_target_shape,
+        out=None):
     """
     np_target_shape is the shape of the np.array
     we want to return; will be the transpose of the
     img.size
+
+    out is an optional pre-allocated uint8 buffer of
+    shape np_target_shape to be re-used
     """
     r0 = image_config['y']
     c0 = image_config['x']
     r1 = r0 + image_config['height']
     c1 = c0 + image_config['width']
 
-    result = np.zeros(np_target_shape, dtype=np.uint8)
-    aff = affpyramid.AffPyramid(image_path)
+    if out is None:
+        out = np.zeros(np_target_shape, dtype=np.uint8)
+    aff = _get_aff_pyramid(image_path)
     aff_data = aff.get_tier(aff.num_tiers-1)
     aff_data = aff_data[r0:r1, c0:c1]
     assert aff_data.dtype == np.uint8
 
-    result[:aff_data.shape[0],
-           :aff_data.shape[1],
-           :] = aff_data
+    _pad_into_buffer(data=aff_data, out=out)
 
-    return result
+    return out
 
 
 def write_image_to_cloud(
@@ -156,31 +213,62 @@ def write_image_to_cloud(
 
     if not np.allclose(data.shape, np_scaled_shape):
         print(f"resizing {data.shape} -> {np_scaled_shape}")
-        data = skimage.transform.resize(
-                    data,
-                    np_scaled_shape,
-                    preserve_range=True,
-                    anti_aliasing=True)
+        if has_cv2:
+            # INTER_AREA stays in uint8; note cv2 takes (width, height)
+            data = cv2.resize(
+                        data,
+                        (np_scaled_shape[1], np_scaled_shape[0]),
+                        interpolation=cv2.INTER_AREA)
+        else:
+            data = skimage.transform.resize(
+                        data,
+                        np_scaled_shape,
+                        preserve_range=True,
+                        anti_aliasing=True)
 
-        data = np.round(data).astype(np.uint8)
+            data = np.round(data).astype(np.uint8)
 
     for x0 in range(0, data.shape[1], dx):
         x1 = min(data.shape[1], x0+dx)
+
+        # (channel, y, x) in C order so that the bytes of each
+        # chunk come out in the (x, y, channel) Fortran order that
+        # the precomputed format expects
+        column = np.ascontiguousarray(
+                        data[:, x0:x1, :].transpose(2, 0, 1))
+
         for y0 in range(0, data.shape[0], dy):
             y1 = min(data.shape[0], y0+dy)
             this_file = this_dir / f"{x0}-{x1}_{y0}-{y1}_{zz_idx}-{zz_idx+1}"
-            with open(this_file, "wb") as out_file:
-                this_data = data[y0:y1, x0:x1, :].transpose(1, 0, 2).tobytes("F")
-                out_file.write(this_data)
+            this_data = column[:, y0:y1, :].tobytes()
+            fd = os.open(this_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                # os.write may write fewer bytes than asked for
+                # (e.g. on network filesystems)
+                view = memoryview(this_data)
+                while len(view) > 0:
+                    n_written = os.write(fd, view)
+                    if n_written == 0:
+                        raise RuntimeError(
+                            f"could not finish writing {this_file}")
+                    view = view[n_written:]
+            finally:
+                os.close(fd)
+
+
+def _get_image_size(image_path):
+    with PIL.Image.open(image_path, 'r') as img:
+        return img.size
 
 
-def get_volume_shape(image_path_list):
-    dx_vals = []
-    dy_vals = []
-    for image_path in image_path_list:
-        with PIL.Image.open(image_path, 'r') as img:
-            dx_vals.append(img.size[0])
-            dy_vals.append(img.size[1])
+def get_volume_shape(image_path_list, n_threads=32):
+    # PIL only reads the header here; use threads to overlap
+    # the latency of reading many headers from network storage
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        size_list = list(executor.map(_get_image_size, image_path_list))
+
+    (dx_vals,
+     dy_vals) = zip(*size_list)
 
     return (max(dx_vals), max(dy_vals), len(image_path_list))
 
@@ -191,6 +279,80 @@ def get_volume_shape_from_config(image_config_list):
     return (width, height, len(image_config_list))
 
 
+def _get_image_path(image_config):
+    """
+    Return the absolute path (as a str) to the image
+    specified by image_config
+    """
+    image_path = pathlib.Path(image_config['storage_directory'])
+    image_path = image_path / image_config['zoom']
+    return str(image_path.resolve().absolute())
+
+
+def _downscale_2x2(data):
+    """
+    Return the 2x2 mean of a (y, x, channel) uint8 image
+    (whose y and x dimensions are even) as a uint8 image,
+    without a floating point intermediate.
+    """
+    if has_cv2:
+        # INTER_AREA at exactly half size is the 2x2 mean;
+        # note cv2 takes (width, height)
+        return cv2.resize(
+                    np.ascontiguousarray(data),
+                    (data.shape[1]//2, data.shape[0]//2),
+                    interpolation=cv2.INTER_AREA)
+
+    # sum the four pixels of each 2x2 block in uint16
+    # (at most 4*255), then divide by 4, rounding half up
+    result = data[0::2, 0::2].astype(np.uint16)
+    result += data[1::2, 0::2]
+    result += data[0::2, 1::2]
+    result += data[1::2, 1::2]
+    result += 2
+    result >>= 2
+    return result.astype(np.uint8)
+
+
+def _build_pyramid(
+        raw_data,
+        info_data):
+    """
+    Build the downsampled versions of raw_data called for by
+    info_data["scales"], each tier being the 2x2 mean of the
+    tier above it.
+
+    Returns a dict mapping scale["key"] to the array that should
+    be passed to write_image_to_cloud for that scale. If a scale
+    cannot be reached by factors of 2, the smallest tier that is
+    still larger than that scale is returned (write_image_to_cloud
+    will resize it).
+    """
+    pyramid = [raw_data]
+    for scale in info_data["scales"]:
+        np_scaled_shape = (scale["size"][1],
+                           scale["size"][0],
+                           3)
+        level = pyramid[-1]
+        while (level.shape[0] > np_scaled_shape[0]
+               and level.shape[0] % 2 == 0
+               and level.shape[1] % 2 == 0):
+            level = _downscale_2x2(level)
+            pyramid.append(level)
+
+    result = dict()
+    for scale in info_data["scales"]:
+        np_scaled_shape = (scale["size"][1],
+                           scale["size"][0],
+                           3)
+        result[scale["key"]] = raw_data
+        for level in pyramid:
+            if (level.shape[0] >= np_scaled_shape[0]
+                    and level.shape[1] >= np_scaled_shape[1]):
+                result[scale["key"]] = level
+    return result
+
+
 def _process_image(
         image_config_lookup,
         image_dir,
@@ -208,23 +370,35 @@ def _process_image(
                      3)
 
 
-    raw_data_path = None
-    raw_data = None
+    raw_data_key = None
+
+    # re-used for every image this worker reads
+    raw_data = np.zeros(np_base_shape, dtype=np.uint8)
 
     for zz_idx in image_config_lookup:
 
         image_config = image_config_lookup[zz_idx]
 
-        image_path = pathlib.Path(image_config['storage_directory'])
-        image_path = image_path / image_config['zoom']
-        image_path = str(image_path.resolve().absolute())
+        image_path = _get_image_path(image_config)
+
+        # the same image can be cropped differently for
+        # different z values
+        this_key = (image_path,
+                    image_config['x'],
+                    image_config['y'],
+                    image_config['width'],
+                    image_config['height'])
 
-        if raw_data_path is None or image_path != raw_data_path:
+        if raw_data_key is None or this_key != raw_data_key:
             raw_data = read_and_pad_image_config(
                         image_config=image_config,
                         image_path=image_path,
-                        np_target_shape=np_base_shape)
-            raw_data_path = image_path
+                        np_target_shape=np_base_shape,
+                        out=raw_data)
+            raw_data_key = this_key
+            scale_to_data = _build_pyramid(
+                        raw_data=raw_data,
+                        info_data=info_data)
 
         for scale in info_data["scales"]:
             img_cloud = write_image_to_cloud(
@@ -232,7 +406,7 @@ def _process_image(
                 key=scale["key"],
                 chunk_size=scale["chunk_sizes"][0],
                 downscale_shape=scale["size"],
-                data=raw_data,
+                data=scale_to_data[scale["key"]],
                 zz_idx=zz_idx)
 
 
@@ -271,13 +445,36 @@ def process_image(
         image_config_list=image_config_list,
         metadata=metadata)
 
+    # send every z value that comes from the same image to the
+    # same worker so that each image is only decoded once
+    path_to_idx = dict()
+    for ii in range(len(image_config_list)):
+        image_path = _get_image_path(image_config_list[ii])
+        if image_path not in path_to_idx:
+            path_to_idx[image_path] = []
+        path_to_idx[image_path].append(ii)
+
+    # assign images to workers largest first, always to the
+    # worker with the fewest pixels so far
+    path_to_pixels = dict()
+    for image_path in path_to_idx:
+        path_to_pixels[image_path] = sum(
+            [image_config_list[idx]['width']*image_config_list[idx]['height']
+             for idx in path_to_idx[image_path]])
+    path_list = list(path_to_idx.keys())
+    path_list.sort(key=lambda x: -path_to_pixels[x])
+
     process_list = []
     sub_lists = []
+    loads = []
     for ii in range(n_processors):
         sub_lists.append(dict())
-    for ii in range(len(image_config_list)):
-        jj = ii % n_processors
-        sub_lists[jj][ii] = image_config_list[ii]
+        loads.append(0)
+    for image_path in path_list:
+        jj = int(np.argmin(loads))
+        loads[jj] += path_to_pixels[image_path]
+        for idx in path_to_idx[image_path]:
+            sub_lists[jj][idx] = image_config_list[idx]
 
     for ii in range(n_processors):
         p = multiprocessing.Process(
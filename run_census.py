@@ -12,7 +12,8 @@ from neuroglancer_interface.utils.celltypes_utils import (
     get_desanitizer)
 
 from neuroglancer_interface.utils.census_utils import (
-    census_from_mask_lookup_and_arr,
+    ConcatenatedMaskLookup,
+    census_from_mask_lookup_and_zarr,
     reformat_census,
     get_structure_name_lookup,
     get_mask_lookup)
@@ -46,6 +47,12 @@ def census_from_structure_lookup(
     Dict containing the results of the census
     """
 
+    # concatenate the masks once; every zarr array below
+    # is censused against the same masks
+    if not isinstance(structure_mask_lookup, ConcatenatedMaskLookup):
+        structure_mask_lookup = ConcatenatedMaskLookup(
+                                    structure_mask_lookup)
+
     result = dict()
     result['genes'] = census_from_mask_and_zarr_dir(
                         mask_pixel_lookup=structure_mask_lookup,
@@ -80,10 +87,11 @@ def census_from_mask_and_zarr_dir(
 
     Parameters
     ----------
-    mask_pixel_lookup: dict
+    mask_pixel_lookup: dict or ConcatenatedMaskLookup
         maps some key to the mask pixels
         (the result of running np.where on the
-        mask array)
+        mask array); pass a ConcatenatedMaskLookup
+        to avoid re-concatenating the masks
 
     zarr_dir: pathlib.Path
         dir containing ome-zarr-ified count data
@@ -101,7 +109,8 @@ def census_from_mask_and_zarr_dir(
     -----
     Because we transposed the data (2, 1, 0) when writing
     to ome-zarr, we undo that transpose when reading back
-    in with zarr.
+    in with zarr (by permuting the mask pixels rather than
+    the data, so that only the masked voxels are read).
     """
     if not zarr_dir.is_dir():
         msg = f"\n{zarr_dir.resolve().absolute()} is not dir"
@@ -112,21 +121,26 @@ def census_from_mask_and_zarr_dir(
         assert s.is_dir()
     sub_dir_list.sort()
 
+    # balanced split; do not start workers with nothing to do
     sub_lists = []
-    for ii in range(n_processors):
-        sub_lists.append([])
-    for ii in range(len(sub_dir_list)):
-        sub_lists[ii%n_processors].append(sub_dir_list[ii])
+    for idx_chunk in np.array_split(np.arange(len(sub_dir_list)),
+                                    n_processors):
+        if len(idx_chunk) == 0:
+            continue
+        sub_lists.append([sub_dir_list[ii] for ii in idx_chunk])
+
+    if not isinstance(mask_pixel_lookup, ConcatenatedMaskLookup):
+        mask_pixel_lookup = ConcatenatedMaskLookup(mask_pixel_lookup)
 
     mgr = multiprocessing.Manager()
     result = mgr.dict()
     lock = mgr.Lock()
 
     process_list = []
-    for ii in range(n_processors):
+    for sub_list in sub_lists:
         p = multiprocessing.Process(
                 target=_census_from_mask_and_zarr_dir_worker,
-                kwargs={'sub_dir_list': sub_lists[ii],
+                kwargs={'sub_dir_list': sub_list,
                         'mask_pixel_lookup': mask_pixel_lookup,
                         'desanitizer': desanitizer,
                         'output_dict': result,
@@ -161,11 +175,10 @@ def _census_from_mask_and_zarr_dir_worker(
             msg = f"two results for {human_name}"
             raise RuntimeError(msg)
 
-        data_arr = np.array(
-                zarr.open(sub_dir, 'r')['0']).transpose(2, 1, 0)
-        this_census = census_from_mask_lookup_and_arr(
+        this_census = census_from_mask_lookup_and_zarr(
             mask_lookup=mask_pixel_lookup,
-            data_arr=data_arr)
+            zarr_arr=zarr.open(sub_dir, 'r')['0'],
+            transpose=(2, 1, 0))
 
         result[human_name] = {'census': this_census,
                               'zarr_path': str(sub_dir.resolve().absolute())}
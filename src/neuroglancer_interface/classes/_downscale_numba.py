@@ -0,0 +1,111 @@
+"""
+Numba kernels for downsampling 3D volumes by integer factors
+(used by XYZScaler when method='gaussian_numba')
+"""
+from typing import Tuple
+import numpy as np
+
+try:
+    import numba
+    has_numba = True
+except ModuleNotFoundError:
+    has_numba = False
+
+
+def get_decimation_weights(factor: int) -> np.ndarray:
+    """
+    Return the smoothing kernel used to downsample one axis
+    by an integer factor.
+
+    The kernel is a box of width factor convolved with the
+    binomial [1, 2, 1]/4, so it has factor+2 taps and sums to 1.
+    For factor == 2 this is the binomial [1, 3, 3, 1]/8.
+    Output pixel i is centered on input pixel
+    (i + 0.5)*factor - 0.5, matching skimage's resize.
+    """
+    box = np.ones(factor, dtype=np.float64)/factor
+    weights = np.convolve(box, np.array([0.25, 0.5, 0.25]))
+    return weights.astype(np.float32)
+
+
+if has_numba:
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _decimate_axis0(src, dst, factor, weights):
+        """
+        Smooth src along axis 0 with weights and keep every
+        factor-th pixel, writing the result into dst
+        (edge pixels are clamped)
+        """
+        n_src = src.shape[0]
+        n_taps = weights.shape[0]
+        for i_dst in numba.prange(dst.shape[0]):
+            first = i_dst*factor - 1
+            for j in range(dst.shape[1]):
+                for k in range(dst.shape[2]):
+                    acc = np.float32(0.0)
+                    for t in range(n_taps):
+                        i_src = min(max(first+t, 0), n_src-1)
+                        acc += weights[t]*src[i_src, j, k]
+                    dst[i_dst, j, k] = acc
+
+
+def gauss_down3d(
+        src: np.ndarray,
+        out_shape: Tuple[int, int, int]) -> np.ndarray:
+    """
+    Downsample a 3D array to out_shape with a separable
+    smoothing kernel (see get_decimation_weights).
+
+    Parameters
+    ----------
+    src: np.ndarray
+        the 3D array to downsample
+
+    out_shape: Tuple[int, int, int]
+        the shape of the result; each dimension of src.shape
+        must be an integer multiple of the corresponding
+        dimension of out_shape
+
+    Returns
+    -------
+    np.ndarray
+        the downsampled array (float32)
+    """
+    if not has_numba:
+        raise RuntimeError(
+            "method='gaussian_numba' requires numba to be installed")
+
+    if len(src.shape) != 3 or len(out_shape) != 3:
+        raise RuntimeError(
+            f"cannot downsample {src.shape} to {out_shape}; "
+            "gauss_down3d only handles 3D arrays")
+
+    current = src
+    for axis in range(3):
+        n_in = current.shape[axis]
+        n_out = out_shape[axis]
+        if n_in == n_out:
+            continue
+        if n_out < 1 or n_in % n_out != 0:
+            raise RuntimeError(
+                f"cannot downsample {src.shape} to {out_shape}; "
+                f"{n_in} is not a multiple of {n_out}")
+        factor = n_in // n_out
+
+        dst_shape = list(current.shape)
+        dst_shape[axis] = n_out
+        dst = np.empty(dst_shape, dtype=np.float32)
+
+        _decimate_axis0(
+            np.moveaxis(current, axis, 0),
+            np.moveaxis(dst, axis, 0),
+            factor,
+            get_decimation_weights(factor))
+
+        current = dst
+
+    if current is src:
+        current = src.astype(np.float32)
+
+    return current
@@ -1,4 +1,5 @@
 from typing import List, Any, Union, Tuple
+import functools
 import numpy as np
 from ome_zarr.scale import Scaler
 from dataclasses import dataclass
@@ -10,6 +11,66 @@ from skimage.transform import resize as skimage_resize
 from neuroglancer_interface.utils.utils import get_prime_factors
 
 
+def _get_base_shape(base) -> Tuple[int, ...]:
+    """
+    Return the shape of base as a tuple of ints, whether base
+    is an array or is already a shape
+    """
+    if isinstance(base, tuple):
+        return tuple(int(n) for n in base)
+    return tuple(int(n) for n in base.shape)
+
+
+@functools.lru_cache(maxsize=128)
+def _get_pyramid_shapes(
+        base_shape: Tuple[int, int, int],
+        downscale_cutoff: int,
+        downscale_z: bool) -> Tuple[Tuple[int, int, int], ...]:
+    """
+    Compute the (nx, ny, nz) shapes of the downsamplings of
+    an array of shape base_shape.
+
+    Each dimension is divided by its prime factors, smallest
+    first, for as long as the result stays at or above
+    downscale_cutoff. The z dimension is only downscaled if
+    downscale_z is True. No level ever has a dimension smaller
+    than min(downscale_cutoff, that dimension of base_shape),
+    and the pyramid ends as soon as no dimension can be
+    divided again without going below downscale_cutoff.
+
+    The result only depends on the arguments, so it is cached;
+    every file written at the same shape shares one computation.
+
+    Returns
+    -------
+    A tuple of (nx, ny, nz) tuples
+    """
+    (nx, ny, nz) = base_shape
+
+    factor_lists = [get_prime_factors(nx), get_prime_factors(ny)]
+    if downscale_z:
+        factor_lists.append(get_prime_factors(nz))
+
+    current = [nx, ny, nz]
+    list_of_nx_ny = []
+
+    keep_going = True
+    while keep_going:
+        keep_going = False
+        for i_dim, factor_list in enumerate(factor_lists):
+            if len(factor_list) > 1:
+                factor = factor_list[0]
+                if current[i_dim] // factor >= downscale_cutoff:
+                    current[i_dim] = current[i_dim] // factor
+                    factor_list.pop(0)
+                    keep_going = True
+
+        if keep_going:
+            list_of_nx_ny.append(tuple(current))
+
+    return tuple(list_of_nx_ny)
+
+
 @dataclass
 class ScalerBase(Scaler):
 
@@ -110,7 +171,7 @@ class XYScaler(ScalerBase):
 
         output = [base]
         print("done downscaling")
-        return output + [results[key].astype(base.dtype)
+        return output + [results[key].astype(base.dtype, copy=False)
                          for key in list_of_nx_ny]
 
     def create_empty_pyramid(
@@ -135,40 +196,11 @@ class XYScaler(ScalerBase):
         """
 
         if not hasattr(self, '_list_of_nx_ny'):
-
-            if isinstance(base, tuple):
-                base_shape = base.shape
-            else:
-                base_shape = base.shape
-
-            nx = base_shape[0]
-            ny = base_shape[1]
-            nz = base_shape[2]
-            nx_factor_list = get_prime_factors(nx)
-            ny_factor_list = get_prime_factors(ny)
-
-            list_of_nx_ny = []
-
-            keep_going = True
-            while keep_going:
-                keep_going = False
-                nx_factor = nx_factor_list[0]
-                ny_factor = ny_factor_list[0]
-                if len(nx_factor_list) > 1:
-                    if nx // nx_factor >= self.downscale_cutoff:
-                        nx = nx // nx_factor
-                        nx_factor_list.pop(0)
-                        keep_going = True
-                if len(ny_factor_list) > 1:
-                    if ny//ny_factor >= self.downscale_cutoff:
-                        ny = ny // ny_factor
-                        ny_factor_list.pop(0)
-                        keep_going = True
-
-                if keep_going:
-                    list_of_nx_ny.append((nx, ny, nz))
-
-            self._list_of_nx_ny = list_of_nx_ny
+            self._list_of_nx_ny = list(
+                _get_pyramid_shapes(
+                    base_shape=_get_base_shape(base),
+                    downscale_cutoff=self.downscale_cutoff,
+                    downscale_z=False))
             self.max_layer = len(self._list_of_nx_ny)
 
             print(f"list_of_nx_ny {self._list_of_nx_ny}")
@@ -190,6 +222,10 @@ class XYZScaler(ScalerBase):
 
         assert len(base.shape) == 3
 
+        if (self.method == 'gaussian_numba'
+                and not isinstance(base, dask.array.Array)):
+            return self.gaussian_numba(base)
+
         if isinstance(base, dask.array.Array):
             resize_func = dask_resize
         else:
@@ -209,9 +245,39 @@ class XYZScaler(ScalerBase):
 
         output = [base]
         print("done downscaling")
-        return output + [results[key].astype(base.dtype)
+        return output + [results[key].astype(base.dtype, copy=False)
                          for key in list_of_nx_ny]
 
+    def gaussian_numba(
+            self,
+            base: np.ndarray) -> List[np.ndarray]:
+        """
+        Downscale with the numba kernel in _downscale_numba
+        (opt in with method='gaussian_numba').
+
+        Each level is computed from the level before it
+        (every level's shape divides the previous one's), so
+        the full resolution array is only smoothed once.
+        """
+        # imported here so that numba is only loaded by
+        # processes that actually ask for this method
+        from neuroglancer_interface.classes._downscale_numba import (
+            gauss_down3d)
+
+        list_of_nx_ny = self.create_empty_pyramid(
+                               base)
+
+        print(f"downscaling to {list_of_nx_ny} (numba)")
+
+        output = [base]
+        current = base
+        for nxyz in list_of_nx_ny:
+            current = gauss_down3d(current, nxyz)
+            output.append(current)
+
+        print("done downscaling")
+        return [output[0]] + [level.astype(base.dtype, copy=False)
+                              for level in output[1:]]
 
     def create_empty_pyramid(
             self,
@@ -234,47 +300,11 @@ class XYZScaler(ScalerBase):
             of the downscalings that will be written to OME-zarr
         """
         if not hasattr(self, '_list_of_nx_ny'):
-
-            if isinstance(base, tuple):
-                base_shape = base.shape
-            else:
-                base_shape = base.shape
-            nx = base_shape[0]
-            ny = base_shape[1]
-            nz = base_shape[2]
-
-            nx_factor_list = get_prime_factors(nx)
-            ny_factor_list = get_prime_factors(ny)
-            nz_factor_list = get_prime_factors(nz)
-
-            list_of_nx_ny = []
-
-            keep_going = True
-            while keep_going:
-                keep_going = False
-                nx_factor = nx_factor_list[0]
-                ny_factor = ny_factor_list[0]
-                nz_factor = nz_factor_list[0]
-                if len(nx_factor_list) > 1:
-                    if nx // nx_factor >= self.downscale_cutoff:
-                        nx = nx // nx_factor
-                        nx_factor_list.pop(0)
-                        keep_going = True
-                if len(ny_factor_list) > 1:
-                    if ny//ny_factor >= self.downscale_cutoff:
-                        ny = ny // ny_factor
-                        ny_factor_list.pop(0)
-                        keep_going = True
-                if len(nz_factor_list) > 1:
-                    if nz // nz_factor >= self.downscale_cutoff:
-                        nz = nz // nz_factor
-                        nz_factor_list.pop(0)
-                        keep_going = True
-
-                if keep_going:
-                    list_of_nx_ny.append((nx, ny, nz))
-
-            self._list_of_nx_ny = list_of_nx_ny
+            self._list_of_nx_ny = list(
+                _get_pyramid_shapes(
+                    base_shape=_get_base_shape(base),
+                    downscale_cutoff=self.downscale_cutoff,
+                    downscale_z=True))
             self.max_layer = len(self._list_of_nx_ny)
 
             print(f"list_of_nx_ny {self._list_of_nx_ny}")
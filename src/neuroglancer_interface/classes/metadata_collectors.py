@@ -2,20 +2,10 @@ import numpy as np
 import pathlib
 import json
 from neuroglancer_interface.utils.census_utils import (
+    ConcatenatedMaskLookup,
     census_from_mask_lookup_and_arr)
-
-
-class DummyLock(object):
-
-    def __enter__(self):
-        pass
-
-    def __exit__(
-            self,
-            exception_type,
-            exception_value,
-            exception_traceback):
-        pass
+from neuroglancer_interface.utils.multiprocessing_utils import (
+    DummyLock)
 
 
 class MetadataCollectorABC(object):
@@ -94,11 +84,19 @@ class CellTypeMetadataCollector(MetadataCollectorABC):
         self._lock = None
         self.masks = None
         self.output_path = metadata_output_path
+        self._census_masks = None
         if structure_set_masks is not None or structure_masks is not None:
             self.masks = {
                 "structure_sets": structure_set_masks,
                 "structures": structure_masks}
 
+            # concatenate each set of masks once, rather than
+            # once per file in collect_metadata
+            self._census_masks = {
+                mask_key: ConcatenatedMaskLookup(self.masks[mask_key])
+                for mask_key in self.masks
+                if self.masks[mask_key] is not None}
+
 
     def collect_metadata(
             self,
@@ -123,14 +121,12 @@ class CellTypeMetadataCollector(MetadataCollectorABC):
 
         this_census = dict()
 
-        if self.masks is not None:
-            for mask_key in self.masks:
-                if self.masks[mask_key] is not None:
-                    sub_census = census_from_mask_lookup_and_arr(
-                                mask_lookup=self.masks[mask_key],
+        if self._census_masks is not None:
+            for mask_key in self._census_masks:
+                this_census[mask_key] = census_from_mask_lookup_and_arr(
+                                mask_lookup=self._census_masks[mask_key],
                                 data_arr=data_array,
                                 rotation_matrix=rotation_matrix)
-                this_census[mask_key] = sub_census
 
         if len(this_census) > 0:
             this['census'] = this_census
@@ -1,13 +1,29 @@
 import numpy as np
-import SimpleITK
+import functools
 import pathlib
 import time
 
+try:
+    import nibabel
+    has_nibabel = True
+except ModuleNotFoundError:
+    has_nibabel = False
+
 from neuroglancer_interface.utils.rotation_utils import (
     rotate_matrix,
     get_rotation_matrix)
 
 
+@functools.lru_cache(maxsize=None)
+def _get_simpleitk():
+    """
+    Import SimpleITK on first use, so that processes that
+    only read through nibabel never pay for importing it
+    """
+    import SimpleITK
+    return SimpleITK
+
+
 class NiftiArray(object):
     """
     A class to carry around and self-consistently manipulate
@@ -32,7 +48,7 @@ class NiftiArray(object):
         return self._rotation_matrix
 
     def _read_quatern_terms(self):
-        img = SimpleITK.ReadImage(self.nifti_path)
+        img = _get_simpleitk().ReadImage(self.nifti_path)
         self._quatern_b = float(img.GetMetaData('quatern_b'))
         self._quatern_c = float(img.GetMetaData('quatern_c'))
         self._quatern_d = float(img.GetMetaData('quatern_d'))
@@ -63,7 +79,7 @@ class NiftiArray(object):
     def _read_metadata(self):
         t0 = time.time()
         print('reading image')
-        img = SimpleITK.ReadImage(self.nifti_path)
+        img = _get_simpleitk().ReadImage(self.nifti_path)
         print(f'reading took {time.time()-t0:.2e} seconds')
         _raw_shape = img.GetSize()
         _raw_shape = np.array([_raw_shape[2],
@@ -111,7 +127,7 @@ class NiftiArray(object):
         print("getting array")
         expected_shape = self.shape  # just to provoke metadata read
         img = self._img
-        arr = SimpleITK.GetArrayFromImage(img)
+        arr = _get_simpleitk().GetArrayFromImage(img)
         print(f"raw arr shape {arr.shape}")
         if len(arr.shape) == 3:
             return rotate_matrix(arr, self.rotation_matrix)
@@ -161,10 +177,102 @@ class NiftiArray(object):
                 'scales': self.scales}
 
 
+class NibabelNiftiArray(NiftiArray):
+    """
+    A NiftiArray that reads the file with nibabel rather than
+    SimpleITK (much faster for loading .nii.gz files; for
+    uncompressed .nii files the data is memory mapped).
+
+    The header fields and array axes are arranged to match
+    what NiftiArray produces from SimpleITK.
+    """
+
+    def __init__(self, nifti_path):
+        if not has_nibabel:
+            raise RuntimeError(
+                "nibabel is not installed; cannot use NibabelNiftiArray")
+        super().__init__(nifti_path)
+
+    def _get_nibabel_img(self):
+        if not hasattr(self, '_img'):
+            self._img = nibabel.load(self.nifti_path)
+        return self._img
+
+    def _read_quatern_terms(self):
+        header = self._get_nibabel_img().header
+        self._quatern_b = float(header['quatern_b'])
+        self._quatern_c = float(header['quatern_c'])
+        self._quatern_d = float(header['quatern_d'])
+        qsq = self._quatern_b**2+self._quatern_c**2+self._quatern_d**2
+        if qsq > 1.0:
+            self._quatern_a = 0.0
+        else:
+            self._quatern_a = np.sqrt(1.0-qsq)
+
+    def _read_metadata(self):
+        img = self._get_nibabel_img()
+
+        # SimpleITK arrays are in the reverse of the
+        # NIFTI (i, j, k) axis order
+        _raw_shape = np.array([img.shape[2],
+                               img.shape[1],
+                               img.shape[0]])
+        self._shape = tuple(np.abs(
+                               np.round(
+                                   np.dot(self.rotation_matrix,
+                                          _raw_shape))).astype(int))
+
+        self._shape = tuple([int(self._shape[idx]) for idx in range(3)])
+
+        self._scales = self._get_scales(img)
+
+    def _get_arr(self) -> np.ndarray:
+        """
+        Will be cast so that arr.shape matches what NiftiArray
+        would produce
+        """
+        img = self._get_nibabel_img()
+        arr = np.asanyarray(img.dataobj)
+
+        # RGB24/RGBA32 files come back as a structured dtype
+        # (fields 'R', 'G', 'B'...); SimpleITK returns these
+        # with the channels along the last axis
+        if arr.dtype.names is not None:
+            arr = np.stack([arr[n] for n in arr.dtype.names], axis=-1)
+
+        # vector-valued voxels are stored along the 5th dimension
+        if len(arr.shape) == 5 and arr.shape[3] == 1:
+            arr = arr[:, :, :, 0, :]
+
+        if len(arr.shape) == 3:
+            return rotate_matrix(arr.transpose(2, 1, 0),
+                                 self.rotation_matrix)
+        elif len(arr.shape) == 4:
+            arr = arr.transpose(2, 1, 0, 3)
+            return np.stack([rotate_matrix(arr[:, :, :, ix],
+                                            self.rotation_matrix)
+                             for ix in range(arr.shape[3])]).transpose(1,2,3,0)
+        else:
+            raise RuntimeError(
+                f"Cannot parse array of shape {arr.shape}")
+
+    def _get_scales(self, img) -> tuple:
+        """
+        Returns dimensions in (1, 2, 3) order as they appear
+        in the NIFTI file
+        """
+        pixdim = img.header['pixdim']
+        _raw = np.array([float(pixdim[3]),
+                         float(pixdim[2]),
+                         float(pixdim[1])])
+        return tuple(np.abs(np.dot(self.rotation_matrix, _raw)))
+
+
 class NiftiArrayCollection(object):
 
-    def __init__(self, nifti_dir_path):
+    def __init__(self, nifti_dir_path, reader='simpleitk'):
         print("in dir path constructor")
+        self.reader = reader
         nifti_dir_path = pathlib.Path(nifti_dir_path)
         if not nifti_dir_path.is_dir():
             raise RuntimeError(
@@ -197,7 +305,8 @@ class NiftiArrayCollection(object):
     def scales(self):
         if not hasattr(self, '_scales'):
             k = list(self.channel_lookup.keys())[0]
-            this = NiftiArray(self.channel_lookup[k])
+            this = _get_nifti_array(self.channel_lookup[k],
+                                    reader=self.reader)
             self._scales = this.scales
         return self._scales
 
@@ -207,7 +316,8 @@ class NiftiArrayCollection(object):
             print("reading shape")
             self._shape = None
             for k in self.channel_lookup:
-                this = NiftiArray(self.channel_lookup[k])
+                this = _get_nifti_array(self.channel_lookup[k],
+                                        reader=self.reader)
                 if self._shape is None:
                     self._shape = this.shape
                 else:
@@ -218,20 +328,32 @@ class NiftiArrayCollection(object):
         if channel is None:
             channel = 'red'
         this_path = self.channel_lookup[channel]
-        nifti_array = NiftiArray(this_path)
+        nifti_array = _get_nifti_array(this_path, reader=self.reader)
 
         return nifti_array.get_channel(
                     channel=None)
 
 
-def get_nifti_obj(nifti_path):
+def _get_nifti_array(nifti_path, reader='simpleitk'):
+    if reader == 'simpleitk':
+        return NiftiArray(nifti_path)
+    elif reader == 'nibabel':
+        return NibabelNiftiArray(nifti_path)
+    raise RuntimeError(
+        f"invalid reader: {reader}")
+
+
+def get_nifti_obj(nifti_path, reader='simpleitk'):
+    """
+    reader is either 'simpleitk' or 'nibabel'
+    """
     nifti_path = pathlib.Path(nifti_path)
     if nifti_path.is_dir():
         print("getting NiftiARrayCollection")
-        return NiftiArrayCollection(nifti_path)
+        return NiftiArrayCollection(nifti_path, reader=reader)
     elif nifti_path.is_file():
         print("getting NiftiArray")
-        return NiftiArray(nifti_path)
+        return _get_nifti_array(nifti_path, reader=reader)
 
     raise RuntimeError(
         f"{nifti_path} is neither file nor dir")
@@ -1,3 +1,4 @@
+import os
 import pathlib
 import json
 import time
@@ -123,7 +124,8 @@ def write_sub_group(
             prefix=prefix,
             downscale=downscale,
             metadata_collector=metadata_collector,
-            only_metadata=only_metadata)
+            only_metadata=only_metadata,
+            default_chunk=64)
 
     print("copying manifest over")
     output_dir = pathlib.Path(root_group.store.path)
@@ -132,7 +134,11 @@ def write_sub_group(
     new_manifest_path = output_dir / 'manifest.csv'
     if new_manifest_path.exists():
         raise RuntimeError(f"{new_manifest_path} already exists")
-    shutil.copy(manifest_path, new_manifest_path)
+    try:
+        os.link(manifest_path, new_manifest_path)
+    except OSError:
+        # e.g. output_dir is on a different filesystem
+        shutil.copy(manifest_path, new_manifest_path)
 
     metadata_collector.write_to_file()
 
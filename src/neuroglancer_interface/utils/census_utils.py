@@ -1,6 +1,17 @@
 import numpy as np
+import csv
 import json
-import SimpleITK
+import logging
+try:
+    import orjson
+    has_orjson = True
+except ModuleNotFoundError:
+    has_orjson = False
+try:
+    import numba
+    has_numba = True
+except ModuleNotFoundError:
+    has_numba = False
 import pathlib
 import multiprocessing
 import pathlib
@@ -8,10 +19,17 @@ import pathlib
 from neuroglancer_interface.classes.nifti_array import (
     get_nifti_obj)
 
+from neuroglancer_interface.utils.utils import (
+    find_files_by_suffix)
+
 from neuroglancer_interface.utils.celltypes_utils import (
     read_list_of_manifests,
     desanitizer_from_meta_manifest)
 
+
+logger = logging.getLogger(__name__)
+
+
 def census_from_mask_lookup_and_arr(
         mask_lookup,
         data_arr,
@@ -37,6 +55,156 @@ def census_from_mask_lookup_and_arr(
     number of counts and the "brightest" voxel
     """
 
+    axis_idx = _get_axis_idx(rotation_matrix)
+
+    if not isinstance(mask_lookup, ConcatenatedMaskLookup):
+        mask_lookup = ConcatenatedMaskLookup(mask_lookup)
+
+    if len(mask_lookup.key_list) == 0:
+        return dict()
+
+    return _census_from_concatenated_values(
+                concatenated_masks=mask_lookup,
+                all_values=data_arr[mask_lookup.all_pixels],
+                axis_idx=axis_idx)
+
+
+def census_from_mask_lookup_and_zarr(
+        mask_lookup,
+        zarr_arr,
+        rotation_matrix=None,
+        transpose=(2, 1, 0)):
+    """
+    Perform the same census as census_from_mask_lookup_and_arr
+    on data stored in a zarr array, only decompressing the chunks
+    that overlap the masks.
+
+    Parameters
+    ----------
+    mask_lookup: dict
+        maps some key to mask pixels (the result
+        of running np.where on the mask array)
+
+    zarr_arr: zarr.Array
+        the count data for this structure
+
+    rotation_matrix:
+        see census_from_mask_lookup_and_arr
+        (if None, the identity is assumed)
+
+    transpose: tuple
+        the mask pixels index np.transpose(zarr_arr, transpose)
+        (rather than transposing the data, the mask pixels are
+        permuted into zarr_arr's axis order)
+
+    Returns
+    -------
+    Dict mapping 'counts' and 'max_voxel' to the total
+    number of counts and the "brightest" voxel
+    """
+    if rotation_matrix is None:
+        rotation_matrix = np.identity(3)
+
+    axis_idx = _get_axis_idx(rotation_matrix)
+
+    if not isinstance(mask_lookup, ConcatenatedMaskLookup):
+        mask_lookup = ConcatenatedMaskLookup(mask_lookup)
+
+    if len(mask_lookup.key_list) == 0:
+        return dict()
+
+    # read all of the masked voxels in a single pass
+    zarr_coords = [None]*3
+    for i_axis in range(3):
+        zarr_coords[transpose[i_axis]] = mask_lookup.all_pixels[i_axis]
+    all_values = zarr_arr.vindex[tuple(zarr_coords)]
+
+    return _census_from_concatenated_values(
+                concatenated_masks=mask_lookup,
+                all_values=all_values,
+                axis_idx=axis_idx)
+
+
+class ConcatenatedMaskLookup(object):
+    """
+    The pixels of every mask in a mask lookup, concatenated
+    (in key order) so that a census can index the data for
+    all of the masks in one pass.
+
+    Build this once per mask lookup and pass it to
+    census_from_mask_lookup_and_arr or
+    census_from_mask_lookup_and_zarr in place of the lookup;
+    otherwise every census call re-concatenates the masks.
+
+    Parameters
+    ----------
+    mask_lookup: dict
+        maps some key to {'mask': the result of running
+        np.where on the mask array, ...}
+
+    Attributes
+    ----------
+    key_list: list
+        the keys of the masks, in concatenation order
+
+    all_pixels: tuple
+        tuple of three arrays of concatenated pixel indices
+
+    lengths: np.ndarray
+        number of pixels contributed by each mask
+
+    starts: np.ndarray
+        mask i occupies all_pixels[:][starts[i]:starts[i+1]]
+    """
+
+    def __init__(self, mask_lookup):
+        self.key_list = list(mask_lookup.keys())
+        self._n_slices = dict()
+
+        if len(self.key_list) == 0:
+            self.all_pixels = tuple(np.zeros(0, dtype=np.int64)
+                                    for i_axis in range(3))
+            self.lengths = np.zeros(0, dtype=np.int64)
+            self.starts = np.zeros(1, dtype=np.int64)
+            return
+
+        self.lengths = np.array([len(mask_lookup[k]['mask'][0])
+                                 for k in self.key_list], dtype=np.int64)
+        if self.lengths.min() == 0:
+            empty = [k for k, n in zip(self.key_list, self.lengths)
+                     if n == 0]
+            raise RuntimeError(f"masks {empty} contain no pixels")
+
+        self.all_pixels = tuple(
+            np.concatenate([mask_lookup[k]['mask'][i_axis]
+                            for k in self.key_list])
+            for i_axis in range(3))
+
+        self.starts = np.concatenate([[0], np.cumsum(self.lengths)])
+
+    def slice_values(self, slice_idx):
+        """
+        The slice index of every concatenated pixel along
+        axis slice_idx
+        """
+        return self.all_pixels[slice_idx]
+
+    def n_slices(self, slice_idx):
+        """
+        One more than the largest value in slice_values(slice_idx)
+        """
+        if slice_idx not in self._n_slices:
+            self._n_slices[slice_idx] = int(
+                self.all_pixels[slice_idx].max()) + 1
+        return self._n_slices[slice_idx]
+
+
+def _get_axis_idx(rotation_matrix):
+    """
+    Return the (i_idx, j_idx, k_idx) tuple indicating which
+    axis of the rotated data corresponds to each axis of the
+    original data
+    """
     i_vec = [1, 0, 0]
     j_vec = [0, 1, 0]
     k_vec = [0, 0, 1]
@@ -61,57 +229,208 @@ def census_from_mask_lookup_and_arr(
             "could not find all idx for rotation_matrix\n"
             f"{rotation_matrix}")
 
+    return (i_idx, j_idx, k_idx)
+
+
+def _census_from_concatenated_values(
+        concatenated_masks,
+        all_values,
+        axis_idx):
+    """
+    Compute the census for every mask at once
+
+    Parameters
+    ----------
+    concatenated_masks: ConcatenatedMaskLookup
+        the masks
+
+    all_values: np.ndarray
+        the data values at concatenated_masks.all_pixels
+
+    axis_idx:
+        the result of _get_axis_idx
+
+    Returns
+    -------
+    Dict mapping each key to a dict containing 'counts',
+    'max_voxel', and 'per_slice'
+    """
+    (i_idx,
+     j_idx,
+     k_idx) = axis_idx
+
     slice_idx = i_idx
 
+    key_list = concatenated_masks.key_list
+    all_pixels = concatenated_masks.all_pixels
+
+    if has_numba:
+        stats_fn = _get_per_mask_stats_numba
+    else:
+        stats_fn = _get_per_mask_stats_numpy
+
+    (totals,
+     max_idx,
+     per_slice_list) = stats_fn(
+                        all_values=all_values,
+                        slice_values=concatenated_masks.slice_values(
+                                                slice_idx),
+                        starts=concatenated_masks.starts,
+                        n_slices=concatenated_masks.n_slices(slice_idx))
+
+    # this loop can run over thousands of masks; avoid
+    # formatting debug output nobody will see
+    debug = logger.isEnabledFor(logging.DEBUG)
+
     result = dict()
-    for mask_key in mask_lookup:
-        mask_pixels = mask_lookup[mask_key]['mask']
-
-        voxel = _get_max_voxel(
-            data_arr=data_arr,
-            mask_pixels=mask_pixels)
-
-        dummy = np.zeros(data_arr.shape, dtype=bool)
-        dummy[mask_pixels] = True
-        assert dummy[voxel[0], voxel[1], voxel[2]]
-
-        print("")
-        print("raw voxel ",voxel)
-        voxel = [voxel[i_idx],
-                 voxel[j_idx],
-                 voxel[k_idx]]
-        print("new voxel ",voxel)
-        print("mask_pixels ", mask_pixels)
-        unq_slice = np.unique(mask_pixels[slice_idx])
+    for i_mask, mask_key in enumerate(key_list):
+        raw_voxel = [int(all_pixels[ii][max_idx[i_mask]])
+                     for ii in range(3)]
+        voxel = [raw_voxel[i_idx],
+                 raw_voxel[j_idx],
+                 raw_voxel[k_idx]]
+        if debug:
+            logger.debug("mask_key %s -- raw voxel %s -- new voxel %s",
+                         mask_key, raw_voxel, voxel)
+
         per_slice_lookup = dict()
-        total = 0.0
-        for idx_value in unq_slice:
-            valid = (mask_pixels[slice_idx] == idx_value)
-            this_val =  float(
-                            data_arr[
-                                mask_pixels[0][valid],
-                                mask_pixels[1][valid],
-                                mask_pixels[2][valid]].sum())
-
-            total += this_val
+        for slice_value, this_val in zip(*per_slice_list[i_mask]):
+            this_val = float(this_val)
             if this_val > 1.0e-20:
-                per_slice_lookup[int(idx_value)] = this_val
-
-        this_result = {'counts': float(total),
-                       'max_voxel': voxel,
-                       'per_slice': per_slice_lookup}
+                per_slice_lookup[int(slice_value)] = this_val
 
-        result[mask_key] = this_result
+        result[mask_key] = {'counts': float(totals[i_mask]),
+                            'max_voxel': voxel,
+                            'per_slice': per_slice_lookup}
 
     return result
 
 
-def _get_max_voxel(
-        data_arr, mask_pixels):
-    idx = np.argmax(data_arr[mask_pixels])
-    voxel = [int(mask_pixels[ii][idx])
-             for ii in range(len(mask_pixels))]
-    return voxel
+def _get_per_mask_stats_numpy(
+        all_values,
+        slice_values,
+        starts,
+        n_slices):
+    """
+    Compute the total, brightest voxel and per-slice sums of
+    every mask in concatenated mask data
+
+    Parameters
+    ----------
+    all_values: np.ndarray
+        the data values at the concatenated mask pixels
+
+    slice_values: np.ndarray
+        the slice index of each concatenated mask pixel
+
+    starts: np.ndarray
+        mask i occupies all_values[starts[i]:starts[i+1]]
+
+    n_slices: int
+        one more than the largest value in slice_values
+
+    Returns
+    -------
+    totals: np.ndarray
+        the sum of each mask
+
+    max_idx: np.ndarray
+        the index (into all_values) of the brightest voxel
+        of each mask (ties go to the earliest voxel, as
+        with np.argmax)
+
+    per_slice_list: list
+        for each mask, a tuple of (slice indices, sums)
+    """
+    lengths = np.diff(starts)
+    n_masks = len(lengths)
+    group_id = np.repeat(np.arange(n_masks), lengths)
+
+    # sort by (mask, descending value); the first element
+    # of each mask is then its brightest voxel
+    order = np.lexsort((-all_values.astype(np.float64), group_id))
+    max_idx = order[starts[:-1]]
+
+    # sum over (mask, slice) pairs
+    (pair_values,
+     pair_inverse) = np.unique(group_id*n_slices + slice_values,
+                               return_inverse=True)
+    pair_sums = np.bincount(pair_inverse, weights=all_values)
+    pair_group = pair_values // n_slices
+    pair_slice = pair_values % n_slices
+
+    totals = np.bincount(pair_group,
+                         weights=pair_sums,
+                         minlength=n_masks)
+
+    # pair_values is sorted, so each mask's pairs are contiguous
+    pair_bounds = np.searchsorted(pair_group, np.arange(n_masks+1))
+    per_slice_list = [
+        (pair_slice[pair_bounds[ii]:pair_bounds[ii+1]],
+         pair_sums[pair_bounds[ii]:pair_bounds[ii+1]])
+        for ii in range(n_masks)]
+
+    return totals, max_idx, per_slice_list
+
+
+def _get_per_mask_stats_numba(
+        all_values,
+        slice_values,
+        starts,
+        n_slices):
+    """
+    Same as _get_per_mask_stats_numpy, but in a single
+    fused pass over the data, parallelized over masks
+
+    In a worker process (e.g. the run_census workers or the
+    pool workers writing NIfTI files) the kernel runs on one
+    thread; the parallelism there comes from the other workers,
+    and letting every worker start cpu_count numba threads
+    would oversubscribe the machine.
+    """
+    if multiprocessing.parent_process() is not None:
+        numba.set_num_threads(1)
+
+    (totals,
+     max_idx,
+     per_slice) = _per_mask_stats_kernel(
+                        np.ascontiguousarray(all_values, dtype=np.float64),
+                        np.ascontiguousarray(slice_values, dtype=np.int64),
+                        np.ascontiguousarray(starts, dtype=np.int64),
+                        n_slices)
+
+    per_slice_list = []
+    for ii in range(len(totals)):
+        slice_idx = np.where(per_slice[ii, :] != 0.0)[0]
+        per_slice_list.append((slice_idx, per_slice[ii, slice_idx]))
+
+    return totals, max_idx, per_slice_list
+
+
+if has_numba:
+
+    @numba.njit(parallel=True, cache=True)
+    def _per_mask_stats_kernel(
+            all_values,
+            slice_values,
+            starts,
+            n_slices):
+        n_masks = len(starts) - 1
+        totals = np.zeros(n_masks, dtype=np.float64)
+        max_idx = np.zeros(n_masks, dtype=np.int64)
+        per_slice = np.zeros((n_masks, n_slices), dtype=np.float64)
+        for i_mask in numba.prange(n_masks):
+            best = -np.inf
+            best_idx = starts[i_mask]
+            for ii in range(starts[i_mask], starts[i_mask+1]):
+                this_val = all_values[ii]
+                per_slice[i_mask, slice_values[ii]] += this_val
+                if this_val > best:
+                    best = this_val
+                    best_idx = ii
+            max_idx[i_mask] = best_idx
+            totals[i_mask] = per_slice[i_mask, :].sum()
+        return totals, max_idx, per_slice
 
 
 def get_structure_name_lookup(
@@ -152,11 +471,11 @@ def get_structure_name_lookup(
 
 def _get_structure_name_from_csv(filepath):
     result = dict()
-    with open(filepath, 'r') as in_file:
+    with open(filepath, 'r', newline='') as in_file:
+        reader = csv.reader(in_file)
+        header = next(reader)
         id_idx = None
         name_idx = None
-        header = in_file.readline()
-        header = header.strip().split(',')
         for ii in range(len(header)):
             if header[ii] == 'id':
                 assert id_idx is None
@@ -168,8 +487,9 @@ def _get_structure_name_from_csv(filepath):
             raise RuntimeError(
                 "could not find 'id' and 'name' in \n"
                 f"{header}")
-        for line in in_file:
-            params = line.strip().split(',')
+        for params in reader:
+            if len(params) == 0:
+                continue
             id_val = int(params[id_idx])
             name_val = params[name_idx]
             assert id_val not in result
@@ -179,7 +499,10 @@ def _get_structure_name_from_csv(filepath):
 
 def _get_structure_name_from_json(filepath):
     with open(filepath, 'rb') as in_file:
-        json_data = json.load(in_file)
+        if has_orjson:
+            json_data = orjson.loads(in_file.read())
+        else:
+            json_data = json.load(in_file)
 
     result = dict()
     for element in json_data:
@@ -221,16 +544,20 @@ def reformat_census(census, structure_name_lookup):
 
 def _get_mask_lookup_worker(file_path_list, output_dict, lock):
     """
-    get a dict mapping integer ID to mask pixels
+    Load the masks in file_path_list into output_dict
 
-    Parametrs
-    ---------
-    mask_dir: pathlib.Path
-        directory to scann for all nii.gz files
+    Parameters
+    ----------
+    file_path_list: List[pathlib.Path]
+        paths to the nii.gz mask files
 
-    Returns
-    -------
-    dict
+    output_dict: dict
+        dict (shared with the parent) mapping integer ID to
+        {'mask': the mask pixels (result of np.where, as int32),
+         'path': the absolute path to the mask file}
+
+    lock:
+        lock guarding output_dict
     """
 
     result = dict()
@@ -238,7 +565,10 @@ def _get_mask_lookup_worker(file_path_list, output_dict, lock):
         id_val = int(file_path.name.split('_')[0])
         nii_obj = get_nifti_obj(file_path)
         mask = nii_obj.get_channel(channel='red')['channel']
-        mask_pixels = np.where(mask==1)
+        # int32 halves the memory (and the pickled size)
+        # of the pixel indices
+        mask_pixels = tuple(np.asarray(pixels, dtype=np.int32)
+                            for pixels in np.where(mask==1))
         result[id_val] = {'mask': mask_pixels,
                           'path': str(file_path.resolve().absolute())}
 
@@ -266,7 +596,7 @@ def get_mask_lookup(mask_dir, n_processors, n_test=None):
     """
     if not isinstance(mask_dir, pathlib.Path):
         mask_dir = pathlib.Path(mask_dir)
-    file_path_list = [n for n in mask_dir.rglob('*nii.gz')]
+    file_path_list = find_files_by_suffix(mask_dir, suffix='nii.gz')
     id_set = set([int(f.name.split('_')[0])
                   for f in file_path_list])
     assert len(id_set) == len(file_path_list)
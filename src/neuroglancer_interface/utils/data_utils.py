@@ -1,18 +1,22 @@
 from typing import List, Any
 import pandas as pd
 import numpy as np
-import SimpleITK
 import pathlib
 import shutil
 import time
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 import zarr
-from numcodecs import blosc
+from numcodecs import blosc, Blosc
 import multiprocessing
 from ome_zarr.io import parse_url
-
-from ome_zarr.writer import write_image
+from ome_zarr.writer import write_multiscales_metadata
+from ome_zarr.format import CurrentFormat
 from neuroglancer_interface.utils.multiprocessing_utils import (
-    _winnow_process_list)
+    pin_worker_to_numa_node,
+    get_n_threads_per_worker,
+    DummyLock)
 
 from neuroglancer_interface.classes.downscalers import (
     XYZScaler)
@@ -49,6 +53,20 @@ def create_root_group(
     return root_group
 
 
+def _get_input_size(nifti_path):
+    """
+    Return the number of bytes on disk of a nifti input.
+
+    Directories (read as a NiftiArrayCollection) are sized by
+    the total of the .nii.gz files they contain.
+    """
+    nifti_path = pathlib.Path(nifti_path)
+    if nifti_path.is_dir():
+        return sum(p.stat().st_size
+                   for p in nifti_path.rglob('*.nii.gz'))
+    return nifti_path.stat().st_size
+
+
 def write_nii_file_list_to_ome_zarr(
         file_path_list,
         group_name_list,
@@ -62,8 +80,11 @@ def write_nii_file_list_to_ome_zarr(
         DownscalerClass=XYZScaler,
         downscale_cutoff=64,
         only_metadata=False,
-        default_chunk=128,
-        channel_list=None):
+        default_chunk=None,
+        channel_list=None,
+        storage_options=None,
+        reader='simpleitk',
+        downscale_method='gaussian'):
     """
     Convert a list of nifti files into OME-zarr format
 
@@ -101,8 +122,21 @@ def write_nii_file_list_to_ome_zarr(
         group. If None, will be created.
 
     default_chunk: int
-        default size for single dimension of chunk when writing
-        data to disk
+        optional upper limit on the size of a single dimension
+        of a chunk when writing data to disk (if None, chunks
+        are sized by write_array_to_group's target_chunk_bytes)
+
+    storage_options: dict
+        optional storage options (e.g. 'compressor') passed
+        through to write_array_to_group
+
+    reader: str
+        either 'simpleitk' or 'nibabel'; the library used to
+        read the nifti files
+
+    downscale_method: str
+        passed through to write_array_to_group
+        (e.g. 'gaussian_numba')
 
     Returns
     -------
@@ -125,6 +159,7 @@ def write_nii_file_list_to_ome_zarr(
     if len(file_path_list) != len(group_name_list):
         msg = f"\ngave {len(file_path_list)} file paths but\n"
         msg += f"{len(group_name_list)} group names"
+        raise RuntimeError(msg)
 
     if root_group is None:
         root_group = create_root_group(
@@ -148,48 +183,65 @@ def write_nii_file_list_to_ome_zarr(
             downscale_cutoff=downscale_cutoff,
             only_metadata=only_metadata,
             default_chunk=default_chunk,
-            channel_list=channel_list)
+            channel_list=channel_list,
+            storage_options=storage_options,
+            reader=reader,
+            downscale_method=downscale_method)
 
     else:
         n_workers = max(1, n_processors-1)
         n_workers = min(n_workers, len(file_path_list))
-        file_lists = []
-        group_lists = []
-        channel_sub_lists = []
-        for ii in range(n_workers):
-            file_lists.append([])
-            group_lists.append([])
-            if channel_list is not None:
-                channel_sub_lists.append([])
-            else:
-                channel_sub_lists.append(None)
 
-        for ii in range(len(file_path_list)):
-            jj = ii % n_workers
-            file_lists[jj].append(file_path_list[ii])
-            group_lists[jj].append(group_name_list[ii])
+        # one task per file, largest file first, so that the
+        # free workers pick up the remaining (smaller) files while
+        # the big ones are running (longest-processing-time-first)
+        size_list = [_get_input_size(p)
+                     for p in file_path_list]
+        task_order = sorted(range(len(file_path_list)),
+                            key=lambda ii: size_list[ii],
+                            reverse=True)
+
+        task_list = []
+        for ii in task_order:
             if channel_list is not None:
-                channel_sub_lists[jj].append(channel_list[ii])
-
-        process_list = []
-        for ii in range(n_workers):
-            p = multiprocessing.Process(
-                    target=_write_nii_file_list_worker,
-                    kwargs={'file_path_list': file_lists[ii],
-                            'group_name_list': group_lists[ii],
-                            'channel_list': channel_sub_lists[ii],
-                            'root_group': parent_group,
-                            'downscale': downscale,
-                            'metadata_collector': metadata_collector,
-                            'DownscalerClass': DownscalerClass,
-                            'downscale_cutoff': downscale_cutoff,
-                            'only_metadata': only_metadata,
-                            'default_chunk': default_chunk,})
-            p.start()
-            process_list.append(p)
-
-        for p in process_list:
-            p.join()
+                channel = channel_list[ii]
+            else:
+                channel = None
+            task_list.append(
+                {'nii_file_path': str(file_path_list[ii]),
+                 'group_name': group_name_list[ii],
+                 'channel': channel})
+
+        parent_group_path = pathlib.Path(root_group.store.path)
+        if prefix is not None:
+            parent_group_path = parent_group_path / prefix
+
+        # split the CPUs between the workers' chunk-writing threads
+        worker_kwargs = {'n_io_threads': get_n_threads_per_worker(n_workers),
+                         'downscale': downscale,
+                         'metadata_collector': metadata_collector,
+                         'DownscalerClass': DownscalerClass,
+                         'downscale_cutoff': downscale_cutoff,
+                         'only_metadata': only_metadata,
+                         'default_chunk': default_chunk,
+                         'storage_options': storage_options,
+                         'reader': reader,
+                         'downscale_method': downscale_method}
+
+        with multiprocessing.Pool(
+                processes=n_workers,
+                initializer=_init_nii_worker,
+                initargs=(str(parent_group_path),
+                          worker_kwargs,
+                          multiprocessing.Value('i', 0),
+                          n_workers)) as pool:
+            for metadata_fragment in pool.imap_unordered(
+                                        _write_one_nii,
+                                        task_list,
+                                        chunksize=1):
+                _merge_metadata_fragment(
+                    metadata_collector=metadata_collector,
+                    metadata_fragment=metadata_fragment)
 
     duration = time.time() - t0
     if prefix is not None:
@@ -198,6 +250,133 @@ def write_nii_file_list_to_ome_zarr(
     return root_group
 
 
+def open_group(group_path):
+    """
+    Re-open an existing OME-zarr group from its path
+
+    (zarr groups do not pickle reliably, so worker processes
+    re-open groups from their paths)
+    """
+    store = parse_url(group_path, mode="w").store
+    return zarr.open_group(store=store, mode="a")
+
+
+# state set in each of the pool workers started by
+# write_nii_file_list_to_ome_zarr
+_nii_worker_state = dict()
+
+
+def _init_nii_worker(
+        parent_group_path,
+        worker_kwargs,
+        worker_counter=None,
+        n_workers=1):
+    """
+    Initializer for the pool workers started by
+    write_nii_file_list_to_ome_zarr
+
+    Parameters
+    ----------
+    parent_group_path: str
+        path to the group into which groups will be written
+
+    worker_kwargs: dict
+        kwargs passed to write_nii_to_group for every file
+
+    worker_counter: multiprocessing.Value
+        shared counter used to give each worker an index,
+        which decides the NUMA node it is pinned to
+        (no pinning if None)
+
+    n_workers: int
+        number of workers in the pool
+
+    Notes
+    -----
+    blosc's own (global context) threads stay disabled in the
+    workers. numcodecs only uses them from the process that
+    imported it, and when it does every compress call goes
+    through one global, mutex-guarded context, which would
+    serialize the chunk-writing threads in write_array_to_group.
+    With use_threads = False each of those threads compresses
+    through its own blosc context, in parallel.
+
+    If worker_kwargs contains a metadata_collector, the worker's
+    copy of it collects into a plain, worker-local dict. Each
+    task returns what it collected (see _write_one_nii) and the
+    parent merges it, so workers never write to the (possibly
+    Manager-backed) metadata dict themselves.
+    """
+    if worker_counter is not None:
+        with worker_counter.get_lock():
+            worker_idx = worker_counter.value
+            worker_counter.value += 1
+        pin_worker_to_numa_node(
+            worker_idx=worker_idx,
+            n_workers=n_workers)
+
+    blosc.use_threads = False
+
+    metadata_collector = worker_kwargs.get('metadata_collector', None)
+    if metadata_collector is not None:
+        metadata_collector.metadata = dict()
+        metadata_collector.set_lock(DummyLock())
+
+    _nii_worker_state['root_group'] = open_group(parent_group_path)
+    _nii_worker_state['kwargs'] = worker_kwargs
+
+
+def _write_one_nii(task):
+    """
+    Write a single nifti file in a pool worker
+
+    The nifti file is only ever read here, in the worker;
+    only its path crosses the process boundary.
+
+    Parameters
+    ----------
+    task: dict
+        {'nii_file_path', 'group_name', 'channel'}
+
+    Returns
+    -------
+    dict
+        the metadata collected for this file (empty if
+        there is no metadata_collector)
+    """
+    write_nii_to_group(
+        root_group=_nii_worker_state['root_group'],
+        **task,
+        **_nii_worker_state['kwargs'])
+
+    metadata_collector = _nii_worker_state['kwargs'].get(
+                              'metadata_collector', None)
+    if metadata_collector is None:
+        return dict()
+
+    metadata_fragment = dict(metadata_collector.metadata)
+    metadata_collector.metadata.clear()
+    return metadata_fragment
+
+
+def _merge_metadata_fragment(
+        metadata_collector,
+        metadata_fragment):
+    """
+    Merge the metadata returned by a pool worker into
+    metadata_collector.metadata (in the parent process)
+    """
+    if metadata_collector is None or len(metadata_fragment) == 0:
+        return
+
+    for metadata_key in metadata_fragment:
+        if metadata_key in metadata_collector.metadata:
+            raise RuntimeError(
+                f"Trying to write {metadata_key} more than once")
+        metadata_collector.metadata[metadata_key] = (
+            metadata_fragment[metadata_key])
+
+
 def _write_nii_file_list_worker(
         file_path_list,
         group_name_list,
@@ -208,7 +387,10 @@ def _write_nii_file_list_worker(
         DownscalerClass=XYZScaler,
         downscale_cutoff=64,
         only_metadata=False,
-        default_chunk=64):
+        default_chunk=None,
+        storage_options=None,
+        reader='simpleitk',
+        downscale_method='gaussian'):
     """
     Worker function to actually convert a subset of nifti
     files to OME-zarr
@@ -230,14 +412,12 @@ def _write_nii_file_list_worker(
         level of zoom.
     """
 
-    for idx in range(len(file_path_list)):
-        f_path = file_path_list[idx]
-        grp_name = group_name_list[idx]
-        if channel_list is not None:
-            channel = channel_list=channel_list[idx]
-        else:
-            channel = None
+    if channel_list is None:
+        channel_list = itertools.repeat(None)
 
+    for f_path, grp_name, channel in zip(file_path_list,
+                                         group_name_list,
+                                         channel_list):
         write_nii_to_group(
             root_group=root_group,
             group_name=grp_name,
@@ -248,7 +428,20 @@ def _write_nii_file_list_worker(
             DownscalerClass=DownscalerClass,
             downscale_cutoff=downscale_cutoff,
             only_metadata=only_metadata,
-            default_chunk=default_chunk)
+            default_chunk=default_chunk,
+            storage_options=storage_options,
+            reader=reader,
+            downscale_method=downscale_method)
+
+
+@functools.lru_cache(maxsize=4096)
+def _resolve_path_str(path_str):
+    """
+    Return the resolved, absolute form of path_str as a str
+    (cached, since resolving a path costs a round of stat calls
+    on every component, which is slow on network filesystems)
+    """
+    return str(pathlib.Path(path_str).resolve().absolute())
 
 
 def write_nii_to_group(
@@ -262,8 +455,12 @@ def write_nii_to_group(
         DownscalerClass=XYZScaler,
         downscale_cutoff=64,
         only_metadata=False,
-        default_chunk=64,
-        channel='red'):
+        default_chunk=None,
+        channel='red',
+        storage_options=None,
+        reader='simpleitk',
+        n_io_threads=4,
+        downscale_method='gaussian'):
     """
     Write a single nifti file to an ome_zarr group
 
@@ -277,12 +474,25 @@ def write_nii_to_group(
     group_name: str
         is the name of the group being created for this data
 
-    nii_file_path: Pathlib.path
+    nii_file_path: str or pathlib.Path
         is the path to the nii file being written
 
     downscale: int
         How much to downscale the image by at each level
         of zoom.
+
+    reader: str
+        either 'simpleitk' or 'nibabel'; the library used to
+        read the nifti file ('nibabel' is much faster, and
+        memory maps uncompressed files)
+
+    n_io_threads: int
+        number of threads compressing and writing chunks
+        (see write_array_to_group)
+
+    downscale_method: str
+        passed through to write_array_to_group
+        (e.g. 'gaussian_numba')
     """
     if group_name is not None:
         if not only_metadata:
@@ -290,7 +500,7 @@ def write_nii_to_group(
     else:
         this_group = root_group
 
-    nii_obj = get_nifti_obj(nii_file_path)
+    nii_obj = get_nifti_obj(nii_file_path, reader=reader)
 
     nii_results = nii_obj.get_channel(
                     channel=channel)
@@ -307,7 +517,7 @@ def write_nii_to_group(
             'x_mm': x_scale,
             'y_mm': y_scale,
             'z_mm': z_scale,
-            'path': str(nii_file_path.resolve().absolute())}
+            'path': _resolve_path_str(str(nii_file_path))}
 
         metadata_collector.collect_metadata(
             data_array=arr,
@@ -316,6 +526,13 @@ def write_nii_to_group(
             metadata_key=group_name)
 
     if not only_metadata:
+        # cast before the write so that the float64 volume
+        # (and the NiftiArray caching it) can be released
+        # before the pyramid is built
+        arr = _as_neuroglancer_dtype(arr)
+        del nii_obj
+        del nii_results
+
         write_array_to_group(
             arr=arr,
             group=this_group,
@@ -325,19 +542,42 @@ def write_nii_to_group(
             downscale=downscale,
             DownscalerClass=DownscalerClass,
             downscale_cutoff=downscale_cutoff,
-            default_chunk=default_chunk)
+            default_chunk=default_chunk,
+            storage_options=storage_options,
+            n_io_threads=n_io_threads,
+            downscale_method=downscale_method)
 
     print(f"wrote {nii_file_path} to {group_name}")
 
 
+def _load_nii_channel(
+        file_path,
+        channel,
+        reader):
+    """
+    Read one channel of a nifti file
+
+    Returns
+    -------
+    (arr, (x_scale, y_scale, z_scale))
+    """
+    nii_obj = get_nifti_obj(file_path, reader=reader)
+    nii_results = nii_obj.get_channel(channel=channel)
+    return (nii_results['channel'], tuple(nii_results['scales']))
+
+
 def write_summed_nii_files_to_group(
         file_path_list,
         group,
         downscale = 2,
         DownscalerClass=XYZScaler,
         downscale_cutoff=64,
-        default_chunk=64,
-        channel='red'):
+        default_chunk=None,
+        channel='red',
+        storage_options=None,
+        reader='simpleitk',
+        n_io_threads=4,
+        downscale_method='gaussian'):
     """
     Sum the arrays in all of the files in file_path list
     into a single array and write that to the specified
@@ -345,45 +585,76 @@ def write_summed_nii_files_to_group(
 
     downscale sets the amount by which to downscale the
     image at each level of zoom
+
+    storage_options is passed through to write_array_to_group
+
+    reader ('simpleitk' or 'nibabel') is the library used to
+    read the nifti files
+
+    n_io_threads is the number of threads compressing and
+    writing chunks (see write_array_to_group)
+
+    downscale_method is passed through to write_array_to_group
     """
 
+    # accumulate in place in a single float32 array
+    # (neuroglancer does not support 64 bit floats anyway)
+    #
+    # the next file is read in a background thread while
+    # the current one is added (both the nifti readers and
+    # numpy release the GIL); at most one file is read ahead
+    # so that only two volumes are in memory at once
+    if len(file_path_list) == 0:
+        raise RuntimeError("no files to sum")
+
     main_array = None
-    for file_path in file_path_list:
-        nii_obj = get_nifti_obj(file_path)
-
-        nii_results = nii_obj.get_channel(
-                        channel=channel)
-
-        this_array = nii_results['channel']
-
-        (this_x_scale,
-         this_y_scale,
-         this_z_scale) = nii_results['scales']
-
-        if main_array is None:
-            main_array = this_array
-            x_scale = this_x_scale
-            y_scale = this_y_scale
-            z_scale = this_z_scale
-            main_pth = file_path
-            continue
-
-        if this_array.shape != main_array.shape:
-            msg = f"\n{main_path} has shape {main_array.shape}\n"
-            msg += f"{file_path} has shape {this_array.shape}\n"
-            msg += "cannot sum"
-            raise RuntimeError(msg)
-
-        if not np.allclose([x_scale, y_scale, z_scale],
-                           [this_x_scale, this_y_scale, this_z_scale]):
-            msg = f"\n{main_path} has scales ("
-            msg += f"{x_scale}, {y_scale}, {z_scale})\n"
-            msg += f"{file_path} has scales ("
-            msg += f"{this_x_scale}, {this_y_scale}, {this_z_scale})\n"
-            msg += "cannot sum"
-            raise RuntimeError
-
-        main_array += this_array
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_future = executor.submit(
+                        _load_nii_channel,
+                        file_path=file_path_list[0],
+                        channel=channel,
+                        reader=reader)
+
+        for idx, file_path in enumerate(file_path_list):
+            (this_array,
+             (this_x_scale,
+              this_y_scale,
+              this_z_scale)) = next_future.result()
+
+            if idx+1 < len(file_path_list):
+                next_future = executor.submit(
+                                _load_nii_channel,
+                                file_path=file_path_list[idx+1],
+                                channel=channel,
+                                reader=reader)
+
+            if main_array is None:
+                main_array = np.empty(this_array.shape, dtype=np.float32)
+                np.copyto(main_array, this_array, casting='unsafe')
+                x_scale = this_x_scale
+                y_scale = this_y_scale
+                z_scale = this_z_scale
+                main_path = file_path
+                del this_array
+                continue
+
+            if this_array.shape != main_array.shape:
+                msg = f"\n{main_path} has shape {main_array.shape}\n"
+                msg += f"{file_path} has shape {this_array.shape}\n"
+                msg += "cannot sum"
+                raise RuntimeError(msg)
+
+            if not np.allclose([x_scale, y_scale, z_scale],
+                               [this_x_scale, this_y_scale, this_z_scale]):
+                msg = f"\n{main_path} has scales ("
+                msg += f"{x_scale}, {y_scale}, {z_scale})\n"
+                msg += f"{file_path} has scales ("
+                msg += f"{this_x_scale}, {this_y_scale}, {this_z_scale})\n"
+                msg += "cannot sum"
+                raise RuntimeError(msg)
+
+            np.add(main_array, this_array, out=main_array, casting='unsafe')
+            del this_array
 
     write_array_to_group(
         arr=main_array,
@@ -394,15 +665,36 @@ def write_summed_nii_files_to_group(
         downscale=downscale,
         DownscalerClass=DownscalerClass,
         downscale_cutoff=downscale_cutoff,
-        default_chunk=default_chunk)
+        default_chunk=default_chunk,
+        storage_options=storage_options,
+        n_io_threads=n_io_threads,
+        downscale_method=downscale_method)
+
+
+def _as_neuroglancer_dtype(arr):
+    """
+    Return arr as a dtype neuroglancer can display.
+
+    neuroglancer does not support 64 bit floats, so float64
+    arrays are cast to float32. Any other array is returned
+    as-is without a copy.
+    """
+    if arr.dtype == np.float64:
+        return arr.astype(np.float32)
+    return arr
 
 
 def _get_nx_ny(
-        arr,
+        shape,
         downscaler):
-
+    """
+    Return the list of (nx, ny, nz) shapes of the downsampled
+    levels that downscaler will produce for an array of the
+    given shape (the geometry itself is cached in the
+    downscalers module, keyed on shape and downscale_cutoff)
+    """
     list_of_nx_ny = downscaler.create_empty_pyramid(
-                          base=arr)
+                          base=tuple(shape))
 
     return list_of_nx_ny
 
@@ -416,9 +708,13 @@ def write_array_to_group(
         downscale: int = 1,
         DownscalerClass=XYZScaler,
         downscale_cutoff=64,
-        default_chunk=64,
+        default_chunk=None,
         axis_order=('x', 'y', 'z'),
-        storage_options=None):
+        storage_options=None,
+        compressor=None,
+        target_chunk_bytes=8*1024*1024,
+        n_io_threads=4,
+        downscale_method='gaussian'):
     """
     Write a numpy array to an ome-zarr group
 
@@ -441,16 +737,47 @@ def write_array_to_group(
         The amount by which to downscale the image at each
         level of zoom
 
+    default_chunk: int
+        optional upper limit on the size of a single dimension
+        of a chunk
+
     axis_order:
         controls the order in which axes are written out to .zattrs
         (note x_scale, y_scale, z_scale will correspond to the 0th,
         1st, and 2nd dimensions in the data, without regard to what
         the axis names are; this needs to be fixed later)
+
+    storage_options:
+        optional dict of storage options (e.g. 'compressor')
+        passed to zarr when creating each level's array
+        ('chunks' is ignored; chunks are set by
+        target_chunk_bytes and default_chunk)
+
+    compressor:
+        numcodecs compressor used for the chunks. If None,
+        Blosc zstd (clevel=3) with bit shuffling is used. Pass
+        e.g. Blosc(cname='lz4') for data that will be read
+        interactively more than it is stored.
+        (a 'compressor' in storage_options takes precedence)
+
+    target_chunk_bytes: int
+        chunks are (roughly) cubes of about this many bytes,
+        so that each chunk is a reasonably sized object to read
+        over HTTP. Dimensions smaller than the cube edge are
+        not split.
+
+    n_io_threads: int
+        number of threads compressing and writing chunks.
+        The full resolution level is written by these threads
+        while the downsampled levels are being computed.
+
+    downscale_method: str
+        passed to DownscalerClass as its method. XYZScaler
+        accepts 'gaussian_numba' to downsample with a numba
+        kernel (requires numba) instead of skimage's resize.
     """
 
-    # neuroglancer does not support 64 bit floats
-    if arr.dtype == np.float64:
-        arr = arr.astype(np.float32)
+    arr = _as_neuroglancer_dtype(arr)
 
     shape = arr.shape
 
@@ -462,20 +789,26 @@ def write_array_to_group(
 
     if downscale > 1:
         scaler = DownscalerClass(
-                   method='gaussian',
+                   method=downscale_method,
                    downscale=downscale,
                    downscale_cutoff=downscale_cutoff)
 
         list_of_nx_ny = _get_nx_ny(
-                            arr=arr,
+                            shape=arr.shape,
                             downscaler=scaler)
 
-        for nxny in list_of_nx_ny:
-            this_coord = [{'scale': [x_scale*arr.shape[0]/nxny[0],
-                                     y_scale*arr.shape[1]/nxny[1],
-                                     z_scale*arr.shape[2]/nxny[2]],
-                           'type': 'scale'}]
-            coord_transform.append(this_coord)
+        # the pyramid already stops before any dimension would
+        # drop below downscale_cutoff; if even the first level
+        # would, there is nothing to downscale at all
+        if len(list_of_nx_ny) > 0:
+            level_scales = (np.array([x_scale, y_scale, z_scale])
+                            * np.array(shape[:3])
+                            / np.array(list_of_nx_ny))
+            coord_transform.extend(
+                [{'scale': this_scale, 'type': 'scale'}]
+                for this_scale in level_scales.tolist())
+        else:
+            scaler = None
     else:
         scaler = None
 
@@ -490,25 +823,150 @@ def write_array_to_group(
          "type": "space",
          "unit": "millimeter"}]
 
-    chunk_x = max(1, min(shape[0]//4, default_chunk))
-    chunk_y = max(1, min(shape[1]//4, default_chunk))
-    chunk_z = max(1, min(shape[2]//4, default_chunk))
-
-    these_storage_opts = {'chunks': (chunk_x, chunk_y, chunk_z)}
+    chunk_edge = int(np.round(
+        (target_chunk_bytes/arr.dtype.itemsize)**(1.0/3.0)))
+    chunk_edge = max(32, chunk_edge)
+    if default_chunk is not None:
+        chunk_edge = min(chunk_edge, default_chunk)
+
+    chunk_x = max(1, min(shape[0], chunk_edge))
+    chunk_y = max(1, min(shape[1], chunk_edge))
+    chunk_z = max(1, min(shape[2], chunk_edge))
+
+    if compressor is None:
+        compressor = Blosc(cname='zstd',
+                           clevel=3,
+                           shuffle=Blosc.BITSHUFFLE)
+
+    # chunks that are entirely background (zero) are not
+    # written at all; readers get them back from fill_value
+    these_storage_opts = {'chunks': (chunk_x, chunk_y, chunk_z),
+                          'compressor': compressor,
+                          'fill_value': 0,
+                          'write_empty_chunks': False}
     if storage_options is not None:
         for k in storage_options:
             if k == 'chunks':
                 continue
             these_storage_opts[k] = storage_options[k]
 
-    write_image(
-        image=arr,
-        scaler=scaler,
+    level_shapes = [tuple(shape)]
+    if scaler is not None:
+        level_shapes += list(list_of_nx_ny)
+
+    level_arrays = _create_level_arrays(
         group=group,
-        coordinate_transformations=coord_transform,
-        axes=axes,
+        shapes=level_shapes,
+        dtype=arr.dtype,
+        chunks=(chunk_x, chunk_y, chunk_z),
         storage_options=these_storage_opts)
 
+    with ThreadPoolExecutor(max_workers=max(1, n_io_threads)) as executor:
+        future_list = _submit_block_writes(
+            executor=executor,
+            zarr_arr=level_arrays[0],
+            data=arr)
+
+        if scaler is not None:
+            pyramid = scaler.nearest(arr)
+            for zarr_arr, data in zip(level_arrays[1:], pyramid[1:]):
+                future_list += _submit_block_writes(
+                    executor=executor,
+                    zarr_arr=zarr_arr,
+                    data=data)
+
+        for future in future_list:
+            future.result()
+
+    datasets = [{'path': str(idx),
+                 'coordinateTransformations': coord_transform[idx]}
+                for idx in range(len(level_shapes))]
+
+    write_multiscales_metadata(
+        group,
+        datasets,
+        fmt=CurrentFormat(),
+        axes=axes,
+        name=None)
+
+
+def _create_level_arrays(
+        group,
+        shapes,
+        dtype,
+        chunks,
+        storage_options):
+    """
+    Create one (empty) zarr array per level of the pyramid,
+    named '0', '1', '2'... as ome_zarr would name them
+
+    Parameters
+    ----------
+    group:
+        the zarr group in which to create the arrays
+
+    shapes:
+        list of the shapes of the levels (full resolution first)
+
+    dtype:
+        the dtype of the arrays
+
+    chunks:
+        the chunk shape (clipped to each level's shape)
+
+    storage_options:
+        dict of other kwargs (compressor, etc.) passed to
+        create_dataset ('chunks' is ignored)
+
+    Returns
+    -------
+    list of zarr arrays, one per level
+    """
+    opts = {k: storage_options[k]
+            for k in storage_options if k != 'chunks'}
+
+    level_arrays = []
+    for idx, level_shape in enumerate(shapes):
+        level_chunks = tuple(max(1, min(c, n))
+                             for c, n in zip(chunks, level_shape))
+        level_arrays.append(
+            group.create_dataset(
+                str(idx),
+                shape=level_shape,
+                chunks=level_chunks,
+                dtype=dtype,
+                **opts))
+    return level_arrays
+
+
+def _submit_block_writes(
+        executor,
+        zarr_arr,
+        data):
+    """
+    Submit one write per chunk of zarr_arr to executor.
+
+    Blocks are aligned with the chunk grid so no two threads
+    ever touch the same chunk. Blosc releases the GIL while
+    compressing, so the writes run in parallel.
+
+    Returns
+    -------
+    list of futures
+    """
+    def _write_block(block):
+        zarr_arr[block] = data[block]
+
+    start_lists = [range(0, n, c)
+                   for n, c in zip(zarr_arr.shape, zarr_arr.chunks)]
+
+    future_list = []
+    for start in itertools.product(*start_lists):
+        block = tuple(slice(s, s+c)
+                      for s, c in zip(start, zarr_arr.chunks))
+        future_list.append(executor.submit(_write_block, block))
+    return future_list
+
 
 def get_celltype_lookups_from_rda_df(
         csv_path):
@@ -520,31 +978,27 @@ def get_celltype_lookups_from_rda_df(
     from Zizhen's .rda file. That is currently out of scope
     """
     df = pd.read_csv(csv_path)
-    cluster = dict()
-    level1 = dict()
-    level2 = dict()
-    for id_arr, label_arr, dest in [(df.Level1_id.values,
-                                     df.Level1_label.values,
-                                     level1),
-                                    (df.Level2_id.values,
-                                     df.Level2_label.values,
-                                     level2),
-                                    (df.cluster_id.values,
-                                     df.cluster_label.values,
-                                     cluster)]:
-        for id_val, label_val in zip(id_arr, label_arr):
-            if np.isnan(id_val):
-                continue
-            id_val = int(id_val)
-            if id_val in dest:
-                if dest[id_val] != label_val:
-                    raise RuntimeError(
-                        f"Multiple values for {id_val}\n"
-                        f"{label_val}\n{dest[id_val]}\n"
-                        f"{line}")
-            else:
-                dest[id_val] = label_val
-
-    return {"cluster": cluster,
-            "Level1": level1,
-            "Level2": level2}
+    result = dict()
+    for id_col, label_col, dest_name in [('Level1_id',
+                                          'Level1_label',
+                                          'Level1'),
+                                         ('Level2_id',
+                                          'Level2_label',
+                                          'Level2'),
+                                         ('cluster_id',
+                                          'cluster_label',
+                                          'cluster')]:
+        sub_df = df[[id_col, label_col]].dropna(subset=[id_col])
+        sub_df = sub_df.astype({id_col: np.int64})
+
+        n_labels = sub_df.groupby(id_col)[label_col].nunique(dropna=False)
+        if (n_labels > 1).any():
+            bad_id = n_labels.index[n_labels > 1].tolist()
+            raise RuntimeError(
+                f"Multiple values of {label_col} for {id_col} {bad_id}")
+
+        result[dest_name] = sub_df.drop_duplicates(
+                                subset=id_col).set_index(
+                                id_col)[label_col].to_dict()
+
+    return result
@@ -1,5 +1,24 @@
 from multiprocessing import Process
-from typing import List
+from typing import List, Optional
+import os
+import pathlib
+
+
+class DummyLock(object):
+    """
+    A no-op stand-in for a multiprocessing lock (for
+    code that only ever runs in one process)
+    """
+
+    def __enter__(self):
+        pass
+
+    def __exit__(
+            self,
+            exception_type,
+            exception_value,
+            exception_traceback):
+        pass
 
 
 def _winnow_process_list(
@@ -21,3 +40,109 @@ def _winnow_process_list(
     for ii in to_pop:
         process_list.pop(ii)
     return process_list
+
+
+def get_n_threads_per_worker(n_workers: int) -> int:
+    """
+    Return the number of threads each of n_workers worker
+    processes can start without oversubscribing the CPUs this
+    process is allowed to use (at least 1)
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        n_cpus = len(os.sched_getaffinity(0))
+    else:
+        n_cpus = os.cpu_count() or 1
+    return max(1, n_cpus // max(1, n_workers))
+
+
+def _parse_cpulist(cpulist: str) -> List[int]:
+    """
+    Parse a Linux cpulist string (e.g. '0-3,8-11') into
+    a list of CPU indices
+    """
+    result = []
+    for element in cpulist.strip().split(','):
+        if len(element) == 0:
+            continue
+        if '-' in element:
+            (first, last) = element.split('-')
+            result += list(range(int(first), int(last)+1))
+        else:
+            result.append(int(element))
+    return result
+
+
+def get_numa_cpu_lists() -> List[List[int]]:
+    """
+    Return one list of CPU indices per NUMA node, restricted
+    to the CPUs this process is allowed to run on.
+
+    Returns a single list (all allowed CPUs) if the NUMA
+    topology cannot be read (e.g. not on Linux).
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        allowed = os.sched_getaffinity(0)
+    else:
+        allowed = set(range(os.cpu_count() or 1))
+
+    cpu_lists = []
+    node_dir = pathlib.Path('/sys/devices/system/node')
+    if node_dir.is_dir():
+        node_path_list = [p for p in node_dir.glob('node[0-9]*')
+                          if (p / 'cpulist').is_file()]
+        node_path_list.sort(key=lambda p: int(p.name[len('node'):]))
+        for node_path in node_path_list:
+            cpu_list = [cpu for cpu in
+                        _parse_cpulist((node_path / 'cpulist').read_text())
+                        if cpu in allowed]
+            if len(cpu_list) > 0:
+                cpu_lists.append(cpu_list)
+
+    if len(cpu_lists) == 0:
+        cpu_lists = [sorted(allowed)]
+
+    return cpu_lists
+
+
+def pin_worker_to_numa_node(
+        worker_idx: int,
+        n_workers: int) -> Optional[List[int]]:
+    """
+    Pin the calling process to the CPUs of one NUMA node.
+
+    Workers are assigned to nodes in contiguous blocks
+    (workers 0..k-1 on node 0, k..2k-1 on node 1, etc.) so that
+    consecutive workers share a node (and its L3 cache). The
+    whole node is used rather than a single CPU so that any
+    compression/IO threads a worker starts still have room.
+
+    Parameters
+    ----------
+    worker_idx: int
+        index of this worker (taken modulo n_workers, so
+        replacement workers are handled)
+
+    n_workers: int
+        total number of workers
+
+    Returns
+    -------
+    The list of CPUs the process was pinned to, or None if
+    no pinning was done (single NUMA node, or no
+    os.sched_setaffinity on this platform)
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+
+    cpu_lists = get_numa_cpu_lists()
+    if len(cpu_lists) < 2:
+        return None
+
+    n_workers = max(1, n_workers)
+    node_idx = ((worker_idx % n_workers)*len(cpu_lists)) // n_workers
+    cpu_list = cpu_lists[node_idx]
+    try:
+        os.sched_setaffinity(0, cpu_list)
+    except OSError:
+        return None
+    return cpu_list
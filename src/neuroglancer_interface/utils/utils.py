@@ -1,3 +1,7 @@
+import os
+import pathlib
+
+
 def get_prime_factors(value):
 
     result = []
@@ -27,3 +31,39 @@ def _next_prime_factor(
         if factor**2 > current_value:
             return None
     return factor
+
+
+def find_files_by_suffix(
+        root_dir,
+        suffix='.nii.gz'):
+    """
+    Recursively find all of the files under root_dir whose names
+    end in suffix (a faster stand-in for pathlib's rglob, which
+    builds a Path object for and stats every entry it visits).
+
+    As with rglob, symlinked directories are not descended into.
+
+    Parameters
+    ----------
+    root_dir: pathlib.Path
+        directory to search
+
+    suffix: str
+        the suffix to match file names against
+
+    Returns
+    -------
+    List[pathlib.Path]
+        the matching files
+    """
+    result = []
+    dir_stack = [str(root_dir)]
+    while len(dir_stack) > 0:
+        this_dir = dir_stack.pop()
+        with os.scandir(this_dir) as entry_iterator:
+            for entry in entry_iterator:
+                if entry.is_dir(follow_symlinks=False):
+                    dir_stack.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    result.append(pathlib.Path(entry.path))
+    return result